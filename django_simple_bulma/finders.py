@@ -4,24 +4,49 @@ Custom collectstatic finders.
 These finders that can be used together with StaticFileStorage
 objects to find files that should be collected by collectstatic.
 """
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+from functools import cached_property, lru_cache
 from os.path import abspath
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
 
-import sass
 from django.conf import settings
 from django.contrib.staticfiles.finders import BaseFinder, get_finder
 from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 from .utils import (
-    get_js_files,
+    _walk,
+    extensions_path,
+    find_themes,
+    get_js_file,
     get_sass_files,
     is_enabled,
     simple_bulma_path,
-    themes,
 )
 
 
+@lru_cache(maxsize=1)
+def _get_staticfiles_dirs() -> Tuple[Path, ...]:
+    """Return the absolute paths of STATICFILES_DIRS, which may also hold (prefix, path) pairs."""
+    return tuple(
+        Path(abspath(directory[1] if isinstance(directory, (list, tuple)) else directory))
+        for directory in settings.STATICFILES_DIRS
+    )
+
+
+@receiver(setting_changed)
+def _clear_caches(*, setting: str, **kwargs) -> None:
+    """Resolve STATICFILES_DIRS again when it changes, e.g. in tests."""
+    if setting == "STATICFILES_DIRS":
+        _get_staticfiles_dirs.cache_clear()
+
+
 class SimpleBulmaFinder(BaseFinder):
     """
     Custom Finder to compile Bulma static files.
@@ -30,6 +55,11 @@ class SimpleBulmaFinder(BaseFinder):
     by the static collector.
     """
 
+    # The Bulma modules, in the order bulma.sass imports them
+    bulma_dirs = (
+        "utilities", "base", "elements", "form", "components", "grid", "helpers", "layout",
+    )
+
     def __init__(self):
         """Initialize the finder with user settings and paths."""
         # Try to get the Bulma settings. The user may not have created this dict.
@@ -39,42 +69,167 @@ class SimpleBulmaFinder(BaseFinder):
             self.bulma_settings = {}
 
         self.bulma_submodule_path = simple_bulma_path / "bulma" / "sass"
+        # SASS wants paths with forward slash
+        self.sass_bulma_submodule_path = self.bulma_submodule_path \
+            .relative_to(simple_bulma_path).as_posix()
+        self.include_paths = [simple_bulma_path.as_posix()]
         self.custom_scss = self.bulma_settings.get("custom_scss", [])
+        self.custom_scss_paths = [self._get_custom_scss_paths(path) for path in self.custom_scss]
         self.variables = self.bulma_settings.get("variables", {})
-        self.output_style = self.bulma_settings.get("output_style", "nested")
+        # Themes come from the same settings as their variables, even if the settings change later
+        self.themes = find_themes(self.bulma_settings)
+        # Unless told otherwise, keep the CSS readable in development and small in production
+        self.output_style = self.bulma_settings.get(
+            "output_style", "nested" if settings.DEBUG else "compressed"
+        )
+        self.use_cache = self.bulma_settings.get("use_cache", True)
         self.storage = FileSystemStorage(simple_bulma_path)
 
         # Make a list of all the finders except this one.
         # We use this in the custom SCSS handler.
-        other_finders = settings.STATICFILES_FINDERS.copy()
-        other_finders.remove("django_simple_bulma.finders.SimpleBulmaFinder")
-        self.other_finders = [get_finder(finder) for finder in other_finders]
+        self.other_finders = [
+            get_finder(finder) for finder in settings.STATICFILES_FINDERS
+            if finder != "django_simple_bulma.finders.SimpleBulmaFinder"
+        ]
+        # Absolute paths the other finders resolved, by relative path
+        self.other_finders_index = {}
+
+    @staticmethod
+    def _get_custom_scss_paths(scss_path: str) -> Tuple[str, str, str]:
+        """
+        Return the paths needed to compile a custom SCSS file.
+
+        That is, the path as configured by the user, the path relative to
+        its static folder, and the relative path of the compiled CSS file.
+        """
+        # Simplify the path to be only the relative path, if they've included the whole thing.
+        relative_path = scss_path.split("static/", 1)[-1]
+        relative_parts = Path(relative_path)
+        return scss_path, relative_path, f"{relative_parts.parent}/{relative_parts.stem}.css"
+
+    @cached_property
+    def enabled_extensions(self) -> Tuple[Path, ...]:
+        """The paths of all enabled extensions."""
+        with os.scandir(extensions_path) as entries:
+            return tuple(Path(entry.path) for entry in entries if is_enabled(entry.name))
 
     @staticmethod
-    def _get_extension_imports() -> str:
-        """Return a string that, in SASS, imports all enabled extensions."""
-        scss_imports = ""
+    @lru_cache(maxsize=None)
+    def _get_extension_imports(enabled_extensions: Tuple[Path, ...]) -> str:
+        """
+        Return a string that, in SASS, imports all enabled extensions.
 
-        for ext in (simple_bulma_path / "extensions").iterdir():
+        This is cached, since the same extensions always need the same imports.
+        """
+        scss_imports = []
 
-            if is_enabled(ext):
-                for src in get_sass_files(ext):
-                    scss_imports += f"@import '{src.as_posix()}';\n"
+        for ext in enabled_extensions:
+            for src in get_sass_files(ext):
+                scss_imports.append(f"@import '{src.as_posix()}';\n")
 
-        return scss_imports
+        return "".join(scss_imports)
 
     @staticmethod
     def _unpack_variables(variables: dict) -> str:
         """Unpacks SASS variables from a dictionary to a compilable string."""
-        scss_string = ""
-        for var, value in variables.items():
-            scss_string += f"${var}: {value};\n"
-        return scss_string
+        return "".join(f"${var}: {value};\n" for var, value in variables.items())
 
     @staticmethod
-    def _get_bulma_js() -> List[str]:
+    def _load_cache() -> Dict[str, Union[str, dict]]:
+        """Return the cache keys of the stylesheets compiled by a previous run."""
+        try:
+            with open(simple_bulma_path / "css" / "bulma.cache", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _replace_file(path: Path, data: bytes) -> None:
+        """
+        Replace the file at path with data, so nothing ever reads a half-written file.
+
+        The data goes to a unique temporary file first, so concurrent runs don't
+        write over each other's, and it gets the permissions a new file would get.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(data)
+            # mkstemp makes the file private to its owner, instead of following the umask
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def _save_cache(cls, cache: Dict[str, Union[str, dict]]) -> None:
+        """Store the cache keys of the compiled stylesheets for the next run."""
+        cls._replace_file(
+            simple_bulma_path / "css" / "bulma.cache",
+            json.dumps(cache, indent=2, sort_keys=True).encode("utf-8"),
+        )
+
+    @staticmethod
+    def _compile(sources: List[Dict[str, str]], **options) -> List[Union[str, Tuple[str, str]]]:
+        """
+        Compiles each source and returns what sass.compile returned for it, in order.
+
+        That's the CSS string, or a (CSS, source map) tuple when a source map is requested.
+        Every source is a dict of keyword arguments for sass.compile, holding either
+        `string` or `filename`, and `options` is passed to all of them.
+
+        libsass holds the GIL while compiling, so when there's more than one
+        source to compile the work is spread over a pool of processes instead.
+        Daemonic processes, like the workers of `manage.py test --parallel`,
+        can't start a pool, so they always compile one source at a time.
+        """
+        # Imported here, so Django processes that never compile don't pay for loading libsass
+        import sass
+
+        # Identical sources, like two themes sharing the same variables, are compiled only once
+        keys = [tuple(source.items()) for source in sources]
+        unique_sources = [dict(key) for key in dict.fromkeys(keys)]
+
+        workers = min(len(unique_sources), os.cpu_count() or 1)
+        if workers <= 1 or multiprocessing.current_process().daemon:
+            css_strings = [sass.compile(**source, **options) for source in unique_sources]
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(sass.compile, **source, **options)
+                    for source in unique_sources
+                ]
+                css_strings = [future.result() for future in futures]
+
+        compiled = dict(zip(dict.fromkeys(keys), css_strings))
+        return [compiled[key] for key in keys]
+
+    @classmethod
+    def _write_css(cls, css_path: Path, css_string: str) -> None:
+        """
+        Write the CSS to css_path, unless the file already holds exactly that CSS.
+
+        Leaving identical files alone keeps their modification time, so tools
+        further down the line, like ManifestStaticFilesStorage, don't reprocess them.
+        Other files are replaced atomically.
+        """
+        css = css_string.encode("utf-8")
+        try:
+            if css_path.read_bytes() == css:
+                return
+        except FileNotFoundError:
+            pass
+
+        cls._replace_file(css_path, css)
+
+    def _get_bulma_js(self) -> List[str]:
         """Return a list of all the js files that are needed for the users selected extensions."""
-        return list(get_js_files())
+        js_files = map(get_js_file, self.enabled_extensions)
+        return [js_file for js_file in js_files if js_file]
 
     @staticmethod
     def find_relative_staticfiles(path: Union[str, Path]) -> Union[Path, None]:
@@ -86,14 +241,46 @@ class SimpleBulmaFinder(BaseFinder):
         if not isinstance(path, Path):
             path = Path(abspath(path))
 
-        for directory in settings.STATICFILES_DIRS:
-            directory = Path(abspath(directory))
-
+        for directory in _get_staticfiles_dirs():
             if directory in path.parents:
                 return path.relative_to(directory)
 
+    def _get_sources_digest(self, enabled_extensions: Tuple[Path, ...]) -> bytes:
+        """Return a digest of the Bulma and enabled extension stylesheets."""
+        digest = hashlib.sha256()
+
+        for source in [self.bulma_submodule_path, *enabled_extensions]:
+            # Walk the same folders imports are taken from, in a fixed order,
+            # so the digest doesn't depend on the filesystem
+            for root, filenames in _walk(source, sort=True):
+                for filename in filenames:
+                    if filename.endswith((".sass", ".scss", ".css")):
+                        path = Path(root, filename)
+                        digest.update(path.relative_to(simple_bulma_path).as_posix().encode())
+                        digest.update(path.read_bytes())
+
+        return digest.digest()
+
+    def _get_imports_digest(
+        self, imports_string: str, enabled_extensions: Tuple[Path, ...]
+    ) -> bytes:
+        """Return a digest of everything a theme's CSS depends on, apart from its variables."""
+        import sass
+
+        digest = hashlib.sha256(self._get_sources_digest(enabled_extensions))
+        digest.update(f"{sass.libsass_version}:{self.output_style}".encode())
+        digest.update(imports_string.encode())
+        return digest.digest()
+
+    @staticmethod
+    def _cache_key(variables_string: str, imports_digest: bytes) -> str:
+        """Return a key that changes whenever the CSS compiled for a theme would change."""
+        return hashlib.sha256(imports_digest + variables_string.encode()).hexdigest()
+
     def _get_bulma_css(self) -> List[str]:
         """Compiles the bulma css files for each theme and returns their relative paths."""
+        import sass
+
         # If the user has the sass module installed in addition to libsass,
         # warn the user and fail hard.
         if not hasattr(sass, "libsass_version"):
@@ -106,65 +293,122 @@ class SimpleBulmaFinder(BaseFinder):
                 "not both `sass` and `libsass`, or this application will not work."
             )
 
-        # SASS wants paths with forward slash:
-        sass_bulma_submodule_path = self.bulma_submodule_path \
-            .relative_to(simple_bulma_path).as_posix()
-
-        bulma_string = f"@import '{sass_bulma_submodule_path}/utilities/_all';\n"
+        sass_bulma_submodule_path = self.sass_bulma_submodule_path
+        bulma_imports = [
+            f"@import '{sass_bulma_submodule_path}/{dirname}/_all';\n"
+            for dirname in self.bulma_dirs
+        ]
 
-        # Now load bulma dynamically.
-        for dirname in self.bulma_submodule_path.iterdir():
-
-            # We already added this earlier
-            if dirname.name == "utilities":
-                continue
+        # Now load in the extensions that the user wants
+        bulma_imports.append(self._get_extension_imports(self.enabled_extensions))
 
-            bulma_string += f"@import '{sass_bulma_submodule_path}/{dirname.name}/_all';\n"
+        # Everything after the variables is the same for every theme,
+        # so it's only built and hashed once.
+        imports_string = "".join(bulma_imports)
+        imports_digest = self._get_imports_digest(imports_string, self.enabled_extensions)
 
-        # Now load in the extensions that the user wants
-        extensions_string = self._get_extension_imports()
+        # Themes whose stylesheet was compiled from the exact same sources are skipped
+        cache = self._load_cache()
+        cached = dict(cache)
 
         # Generate SASS strings for each theme
         # The default theme is treated as ""
         theme_paths = []
-        for theme in [""] + themes:
-            scss_string = "@charset 'utf-8';\n"
-
+        pending = []
+        for theme in ("", *self.themes):
             # Unpack this theme's custom variables
             variables = self.variables
             if theme:
-                variables = settings.BULMA_SETTINGS[f"{theme}_variables"]
-            scss_string += self._unpack_variables(variables)
-
-            scss_string += bulma_string
-            scss_string += extensions_string
+                variables = self.bulma_settings[f"{theme}_variables"]
 
-            # Store this as a css file
-            css_string = sass.compile(string=scss_string,
-                                      output_style=self.output_style,
-                                      include_paths=[simple_bulma_path.as_posix()])
+            variables_string = self._unpack_variables(variables)
 
             theme_path = f"css/{theme + '_' if theme else ''}bulma.css"
             css_path = simple_bulma_path / theme_path
-            with open(css_path, "w", encoding="utf-8") as bulma_css:
-                bulma_css.write(css_string)
+            cache_key = self._cache_key(variables_string, imports_digest)
+
+            if not self.use_cache or cache.get(theme_path) != cache_key or not css_path.exists():
+                scss_string = "".join([
+                    "@charset 'utf-8';\n",
+                    variables_string,
+                    imports_string,
+                ])
+                pending.append(({"string": scss_string}, css_path))
+                cache[theme_path] = cache_key
+
             theme_paths.append(theme_path)
 
-        return theme_paths
+        # Compile the themes that changed
+        css_strings = self._compile(
+            [source for source, _ in pending],
+            output_style=self.output_style,
+            include_paths=self.include_paths,
+        )
 
-    def _get_custom_css(self) -> str:
-        """Compiles any custom-specified SASS and returns its relative path."""
-        paths = []
+        # Store these as css files, recreating the css folder if it has been removed
+        (simple_bulma_path / "css").mkdir(exist_ok=True)
+        for (_, css_path), css_string in zip(pending, css_strings):
+            self._write_css(css_path, css_string)
 
-        for scss_path in self.custom_scss:
-            # Simplify the path to be only the relative path, if they've included the whole thing.
-            relative_path = scss_path.split("static/", 1)[-1]
+        if cache != cached:
+            self._save_cache(cache)
+        return theme_paths
 
-            # Check that we can find this file with one of the other finders.
+    def _custom_cache_key(self, sources: List[str]) -> Union[str, None]:
+        """
+        Return a key that changes whenever the CSS compiled from these sources would change.
+
+        The sources are every stylesheet a custom SCSS file was compiled from, as
+        listed in its source map. Returns None if any of them can't be read anymore.
+        """
+        import sass
+
+        digest = hashlib.sha256(f"{sass.libsass_version}:{self.output_style}".encode())
+
+        for source in sources:
+            digest.update(source.encode())
+            try:
+                digest.update(Path(source).read_bytes())
+            except OSError:
+                return None
+
+        return digest.hexdigest()
+
+    def _is_custom_css_current(self, cache_entry: Union[dict, None], scss_path: str) -> bool:
+        """Return whether the CSS cached for scss_path was compiled from its current sources."""
+        return (
+            self.use_cache
+            and isinstance(cache_entry, dict)
+            and cache_entry.get("filename") == scss_path
+            and cache_entry.get("key") == self._custom_cache_key(cache_entry.get("sources", []))
+        )
+
+    def _find_with_other_finders(self, relative_path: str) -> Union[str, None]:
+        """Return the absolute path the first of the other finders resolves relative_path to."""
+        if relative_path not in self.other_finders_index:
             absolute_path = None
             for finder in self.other_finders:
                 if absolute_path := finder.find(relative_path):
                     break
+            # Finders signal a miss with an empty list rather than None
+            self.other_finders_index[relative_path] = absolute_path or None
+
+        return self.other_finders_index[relative_path]
+
+    def _get_custom_css(self) -> List[str]:
+        """Compiles any custom-specified SASS and returns its relative path."""
+        paths = []
+        pending = []
+        cache = self._load_cache()
+        cached = dict(cache)
+
+        for scss_path, relative_path, output_path in self.custom_scss_paths:
+            # Plain CSS has nothing to compile, and the other finders already collect it
+            if scss_path.endswith(".css"):
+                continue
+
+            # Check that we can find this file with one of the other finders.
+            absolute_path = self._find_with_other_finders(relative_path)
 
             # Raise an error if we can't find it.
             if absolute_path is None:
@@ -175,26 +419,48 @@ class SimpleBulmaFinder(BaseFinder):
                     "information about how static files are discovered."
                 )
 
-            # Prepare the paths. SASS wants forwardslash string, the rest needs a Path.
-            absolute_path = str(absolute_path).replace("\\", "/")
-            relative_path = Path(relative_path)
-
-            # Now load up the scss file
-            scss_string = f'@import "{absolute_path}";'
-
-            # Store this as a css file - we don't check and raise here because it would have
-            # already happened earlier, during the Bulma compilation
-            css_string = sass.compile(string=scss_string, output_style=self.output_style)
-
-            css_path = simple_bulma_path / relative_path.parent
-            css_path.mkdir(parents=True, exist_ok=True)
-            css_path = f"{css_path}/{relative_path.stem}.css"
-
-            with open(css_path, "w") as css_file:
-                css_file.write(css_string)
-
-            paths.append(f"{relative_path.parent}/{relative_path.stem}.css")
-
+            css_path = simple_bulma_path / output_path
+            css_path.parent.mkdir(parents=True, exist_ok=True)
+
+            absolute_path = str(absolute_path)
+            cache_entry = cache.get(output_path)
+            if not self._is_custom_css_current(cache_entry, absolute_path) \
+                    or not css_path.exists():
+                # libsass reads the scss file itself. The source map is only used
+                # to learn which files were imported, so the cache can track them.
+                source = {
+                    "filename": absolute_path,
+                    "source_map_filename": f"{css_path}.map",
+                }
+                pending.append((source, output_path, css_path))
+
+            paths.append(output_path)
+
+        # Compile everything that changed - we don't check and raise here because it would
+        # have already happened earlier, during the Bulma compilation
+        results = self._compile(
+            [source for source, _, _ in pending],
+            output_style=self.output_style,
+            omit_source_map_url=True,
+        )
+
+        # Store these as css files, and remember what they were compiled from
+        for (source, output_path, css_path), (css_string, source_map) in zip(pending, results):
+            self._write_css(css_path, css_string)
+
+            # Sources in the map are relative to the map itself
+            sources = [
+                os.path.normpath(os.path.join(css_path.parent, path))
+                for path in json.loads(source_map)["sources"]
+            ]
+            cache[output_path] = {
+                "filename": source["filename"],
+                "sources": sources,
+                "key": self._custom_cache_key(sources),
+            }
+
+        if cache != cached:
+            self._save_cache(cache)
         return paths
 
     def find(self, path: str, all: bool = False) -> Union[List[str], str]:
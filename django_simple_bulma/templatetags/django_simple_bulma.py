@@ -28,9 +28,10 @@ def bulma(theme: str = "", *, include_js: bool = True) -> SafeString:
     """
     from ..utils import (
         get_js_files,
+        get_themes,
         logger,
-        themes,
     )
+    themes = get_themes()
     if theme and theme not in themes:
         logger.warning(
             f"Theme '{theme}' does not match any of the detected themes: {', '.join(themes)}. "
@@ -38,7 +39,8 @@ def bulma(theme: str = "", *, include_js: bool = True) -> SafeString:
         )
         theme = ""
 
-    # Build the html to include the stylesheet
+    # Build the html to include the stylesheet. The URLs come from the storage,
+    # which may sign them or change them between requests, so they aren't cached.
     css = static(f"css/{theme + '_' if theme else ''}bulma.css")
     stylesheet_id = f"bulma-css-{theme}" if theme else "bulma-css"
 
@@ -63,7 +65,8 @@ def font_awesome() -> SafeString:
     Returns whatever kit has been specified in BULMA_SETTINGS.
     If none is provided, default to version 5.14.0
     """
-    from ..utils import fontawesome_token
+    from ..utils import get_fontawesome_token
+    fontawesome_token = get_fontawesome_token()
     if fontawesome_token:
         cdn_link = (
             '<link rel="preload" '
@@ -1,31 +1,28 @@
 """Django Simple Bulma utilities. Ultimately helps ensure DRY code."""
 
+import fnmatch
 import logging
+import os
 import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Generator, List, Union
+from typing import FrozenSet, Iterator, List, Optional, Tuple, Union
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 # Captures any word characters before "_variables"
 # Basically equivalent to "\w+_variables"
 variables_name_re = re.compile(r"^(?P<name>\w+)_variables$")
-themes = []
-
-# If BULMA_SETTINGS has not been declared if no extensions
-# have been defined, default to all extensions.
-if hasattr(settings, "BULMA_SETTINGS"):
-    extensions = settings.BULMA_SETTINGS.get("extensions", [])
-    fontawesome_token = settings.BULMA_SETTINGS.get("fontawesome_token", "")
-    for key in settings.BULMA_SETTINGS:
-        match = variables_name_re.match(key)
-        if match:
-            themes.append(match.group("name"))
-else:
-    extensions = []
-    fontawesome_token = ""
 
 simple_bulma_path = Path(__file__).resolve().parent
+extensions_path = os.path.join(simple_bulma_path, "extensions")
+# Everything we look up lives in simple_bulma_path, so paths are made relative by slicing
+_simple_bulma_prefix = os.path.join(simple_bulma_path, "")
+
+# Folders inside extensions that never hold anything to collect, along with hidden ones
+_pruned_folders = frozenset({"node_modules", "__pycache__", "test", "tests"})
 
 # (Path, str) pairs describing a relative path in an extension and a glob pattern to search for
 sass_files_searches = (
@@ -39,48 +36,178 @@ sass_files_searches = (
     (Path(""), "*.s[ac]ss"),
 )
 
+# The same searches, with the relative paths as prefixes of the folders below them,
+# and the glob patterns compiled to regular expressions once
+_sass_files_patterns = tuple(
+    (
+        os.path.join(rel_path, "") if rel_path.parts else "",
+        re.compile(fnmatch.translate(glob)),
+        glob.endswith(".css"),
+    )
+    for rel_path, glob in sass_files_searches
+)
+
 logger = logging.getLogger("django-simple-bulma")
 
 
+def find_themes(bulma_settings: dict) -> Tuple[str, ...]:
+    """Return the names of all the themes defined in the given Bulma settings."""
+    themes = []
+
+    for key in bulma_settings:
+        # Most keys aren't themes, and those are ruled out without running the regex
+        if key.endswith("_variables"):
+            match = variables_name_re.match(key)
+            if match:
+                themes.append(match.group("name"))
+
+    return tuple(themes)
+
+
+@lru_cache(maxsize=None)
+def get_themes() -> Tuple[str, ...]:
+    """Return the names of all the themes defined in BULMA_SETTINGS."""
+    return find_themes(getattr(settings, "BULMA_SETTINGS", {}))
+
+
+@lru_cache(maxsize=None)
+def get_fontawesome_token() -> str:
+    """Return the FontAwesome kit in BULMA_SETTINGS, or an empty string if there is none."""
+    return getattr(settings, "BULMA_SETTINGS", {}).get("fontawesome_token", "")
+
+
+@lru_cache(maxsize=None)
+def _get_enabled_extensions() -> Union[str, FrozenSet[str]]:
+    """Return "all", or the names of the extensions enabled in BULMA_SETTINGS."""
+    # If BULMA_SETTINGS has not been declared or no extensions
+    # have been defined, don't load any extensions.
+    extensions = getattr(settings, "BULMA_SETTINGS", {}).get("extensions", [])
+
+    # Extensions are looked up by name, so unless all of them are enabled, keep them in a set
+    if extensions == "all":
+        return extensions
+    return frozenset(extensions)
+
+
 def is_enabled(extension: Union[Path, str]) -> bool:
     """Return whether an extension is enabled or not."""
+    extensions = _get_enabled_extensions()
     if isinstance(extension, Path):
         return extensions == "all" or extension.name in extensions
     return extensions == "all" or extension in extensions
 
 
-def get_js_files() -> Generator[str, None, None]:
-    """Yield all the js files that are needed for the users selected extensions."""
-    # For every extension...
-    for ext in (simple_bulma_path / "extensions").iterdir():
-        # ...check if it is enabled...
-        if is_enabled(ext):
-            dist_folder = ext / "dist"
-
-            # ...and add its JS file.
-            # This really makes a lot of assumptions about the extension,
-            # but so does everything else up until here.
-            # Basically, try get a minified version first before settling
-            # for whatever might be there.
-            js_file = next(dist_folder.rglob("*.min.js"), None) or \
-                next(dist_folder.rglob("*.js"), None)
-            if js_file:
-                yield js_file.relative_to(simple_bulma_path).as_posix()
-
-
-def get_sass_files(ext: Path) -> List[Path]:
-    """Given the path to an extension, find and yield all files that should be imported."""
-    for rel_path, glob in sass_files_searches:
-        src_files = list((ext / rel_path).rglob(glob))
-
-        for i, src in enumerate(src_files):
-            # Remove suffix from css files, otherwise they wont get compiled, only referenced
-            if glob.endswith(".css"):
-                src = src.with_suffix("")
-            src_files[i] = src.relative_to(simple_bulma_path)
+def _walk(folder: Path, *, sort: bool = False) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Walk folder top-down like os.walk, skipping the folders in _pruned_folders.
+
+    If sort is True, folders and files are visited in sorted order
+    instead of the order the filesystem lists them in.
+    """
+    for root, dirnames, filenames in os.walk(folder):
+        if sort:
+            dirnames.sort()
+            filenames.sort()
+        dirnames[:] = [
+            dirname for dirname in dirnames
+            if dirname not in _pruned_folders and not dirname.startswith(".")
+        ]
+        yield root, filenames
+
+
+def _relative_posix(path: str) -> str:
+    """Return a path within simple_bulma_path relative to it, with forward slashes."""
+    return path[len(_simple_bulma_prefix):].replace(os.sep, "/")
+
+
+@lru_cache(maxsize=None)
+def get_js_file(ext: Path) -> Optional[str]:
+    """
+    Given the path to an extension, return its JS file, if it has one.
+
+    Extensions are shipped with the package and don't change, so each one
+    is only searched once.
+    """
+    js_file = None
+
+    # This really makes a lot of assumptions about the extension,
+    # but so does everything else up until here.
+    # Basically, try get a minified version first before settling
+    # for whatever might be there. Both are looked for in a single walk.
+    for root, filenames in _walk(ext / "dist"):
+        for filename in filenames:
+            if filename.endswith(".min.js"):
+                return _relative_posix(os.path.join(root, filename))
+            if js_file is None and filename.endswith(".js"):
+                js_file = os.path.join(root, filename)
+
+    if js_file:
+        return _relative_posix(js_file)
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_js_files() -> Tuple[str, ...]:
+    """
+    Return all the js files that are needed for the users selected extensions.
+
+    The result is cached rather than walking the extension folders every time,
+    until BULMA_SETTINGS changes.
+    """
+    js_files = []
 
+    # For every extension...
+    with os.scandir(extensions_path) as entries:
+        for entry in entries:
+            # ...check if it is enabled...
+            if is_enabled(entry.name):
+                # ...and add its JS file.
+                js_file = get_js_file(Path(entry.path))
+                if js_file:
+                    js_files.append(js_file)
+
+    return tuple(js_files)
+
+
+@lru_cache(maxsize=None)
+def get_sass_files(ext: Path) -> Tuple[Path, ...]:
+    """
+    Given the path to an extension, find all files that should be imported.
+
+    Like get_js_file, each extension is only searched once.
+    """
+    ext_prefix = os.path.join(ext, "")
+
+    # Walk the extension once, sorting its files into every search they match
+    matches = [[] for _ in _sass_files_patterns]
+    for root, filenames in _walk(ext):
+        folder = os.path.join(root[len(ext_prefix):], "")
+
+        for (rel_folder, pattern, is_css), src_files in zip(_sass_files_patterns, matches):
+            if not folder.startswith(rel_folder):
+                continue
+
+            for filename in filenames:
+                if pattern.match(filename):
+                    # Remove suffix from css files, otherwise they only get referenced
+                    if is_css:
+                        filename = os.path.splitext(filename)[0]
+                    src_files.append(Path(_relative_posix(os.path.join(root, filename))))
+
+    # Use the first search that found anything
+    for src_files in matches:
         if src_files:
-            return src_files
+            return tuple(src_files)
 
     # Extension has no stylesheets
-    return []
+    return ()
+
+
+@receiver(setting_changed)
+def _clear_caches(*, setting: str, **kwargs) -> None:
+    """Forget everything read from BULMA_SETTINGS when it changes, e.g. in tests."""
+    if setting == "BULMA_SETTINGS":
+        get_themes.cache_clear()
+        get_fontawesome_token.cache_clear()
+        _get_enabled_extensions.cache_clear()
+        get_js_files.cache_clear()